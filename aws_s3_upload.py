@@ -1,110 +1,533 @@
 import os
 import sys
-import argparse
-import boto3
 from pathlib import Path
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Iterable, Iterator, Union, TYPE_CHECKING
 import concurrent.futures
-from threading import Lock
+import threading
+import queue
+import itertools
 import time
+import random
+import hashlib
+import functools
+import collections
+import asyncio
+
+# boto3/botocore/urllib3/argparse 都在用到时才导入，只使用 get_file_headers 等工具函数时无需加载
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
 
 region = "us-west-2"
 bucket_name = "image-browser"
 env_access_key_id = "oss_image_browser_access_key_id"
 env_access_key_secret = "oss_image_browser_access_key_secret"
 
+# 遇到 503 SlowDown 时的额外退避重试次数（botocore 自身的自适应重试用尽之后）
+SLOWDOWN_MAX_ATTEMPTS = 5
+
+# 进度输出限流：每完成 PROGRESS_EVERY 个文件或间隔 PROGRESS_INTERVAL 秒输出一行（失败总是输出）
+PROGRESS_EVERY = 100
+PROGRESS_INTERVAL = 0.5
+
+# 慢请求重传：根据最近 STRAGGLER_SAMPLES 次小文件请求耗时（从开始发送算起）的 p99，
+# 耗时超过 p99 * 2（且不少于 STRAGGLER_MIN_TIMEOUT 秒）的上传再发起一次，先完成的为准；
+# 同时进行的重传不超过 workers // STRAGGLER_HEDGE_RATIO 个（至少 1 个），
+# 遇到 SlowDown 后的退避期间及之后 SLOWDOWN_HEDGE_COOLDOWN 秒内不重传
+STRAGGLER_SAMPLES = 1000
+STRAGGLER_MIN_SAMPLES = 100
+STRAGGLER_MIN_TIMEOUT = 1.0
+STRAGGLER_CHECK_INTERVAL = 0.5
+STRAGGLER_HEDGE_RATIO = 10
+SLOWDOWN_HEDGE_COOLDOWN = 30
+
+# asyncio 模式下每次在线程中遍历目录取出的任务数
+ASYNC_WALK_BATCH = 256
+
+# HTTP 连接发送请求体时每次 send() 的块大小（默认仅 8 KiB，小对象上传时系统调用过多）
+HTTP_SEND_BLOCKSIZE = 1024 * 1024
+
+# 根据文件扩展名设置的 Content-Type
+_CONTENT_TYPES = {
+    '.html': 'text/html',
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+    '.json': 'application/json',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.svg': 'image/svg+xml',
+    '.ico': 'image/x-icon',
+    '.webp': 'image/webp',
+    '.txt': 'text/plain',
+    '.md': 'text/markdown',
+    '.xml': 'application/xml',
+    '.pdf': 'application/pdf',
+    '.zip': 'application/zip',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.ttf': 'font/ttf',
+    '.eot': 'application/vnd.ms-fontobject'
+}
+
+# 本地文件：单文件上传时为 Path，目录遍历时为 os.scandir 产生的 DirEntry
+LocalFile = Union[Path, os.DirEntry]
+
+
+class _TransferWatcher:
+    """
+    TransferManager 订阅者：记录请求开始发送的时刻（首次 on_progress），
+    开始发送或传输结束时触发共享的 changed 事件；on_finish 在传输结束时调用
+    """
+    
+    def __init__(self, changed: threading.Event, on_finish: Optional[Any] = None):
+        self.changed = changed
+        self.on_finish = on_finish
+        self.started_at = None
+    
+    def on_progress(self, future, bytes_transferred, **kwargs) -> None:
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+            self.changed.set()
+    
+    def on_done(self, future, **kwargs) -> None:
+        if self.on_finish:
+            self.on_finish()
+        self.changed.set()
+
+
+def _set_default_blocksize(connection_cls: type, blocksize: int) -> None:
+    """修改 connection_cls.__init__ 中 blocksize 参数的默认值"""
+    init = connection_cls.__init__
+    if init.__kwdefaults__ and 'blocksize' in init.__kwdefaults__:
+        init.__kwdefaults__ = {**init.__kwdefaults__, 'blocksize': blocksize}
+        return
+    code = init.__code__
+    names = code.co_varnames[:code.co_argcount]
+    defaults = list(init.__defaults__ or ())
+    if 'blocksize' in names:
+        index = names.index('blocksize') - (len(names) - len(defaults))
+        if index >= 0:
+            defaults[index] = blocksize
+            init.__defaults__ = tuple(defaults)
+
+
+def _tune_http_connections() -> None:
+    """
+    调大 botocore 发送请求时使用的 blocksize
+    
+    botocore 的连接继承自 urllib3：urllib3 2.x 的 HTTPConnection 和 HTTPSConnection
+    各自声明了 blocksize 默认值，1.26 则沿用 http.client 的默认值，几层都需要调整；
+    较新的 botocore 在 urllib3 2.x 下还会通过 httpsession.BUFFER_SIZE 显式传入 blocksize。
+    """
+    import http.client
+    import urllib3.connection
+    import botocore.httpsession
+    for connection_cls in (http.client.HTTPConnection, http.client.HTTPSConnection,
+                           urllib3.connection.HTTPConnection, urllib3.connection.HTTPSConnection):
+        _set_default_blocksize(connection_cls, HTTP_SEND_BLOCKSIZE)
+    if getattr(botocore.httpsession, 'BUFFER_SIZE', None):
+        botocore.httpsession.BUFFER_SIZE = max(botocore.httpsession.BUFFER_SIZE, HTTP_SEND_BLOCKSIZE)
+
+
+def _is_slowdown(error: BaseException) -> bool:
+    """
+    判断异常是否为 503 SlowDown
+    
+    upload_file（boto3 和 aioboto3）会把 ClientError 包装成 S3UploadFailedError，
+    因此沿着 __cause__/__context__ 查找原始的 ClientError。
+    """
+    from botocore.exceptions import ClientError
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, ClientError):
+            code = error.response.get('Error', {}).get('Code')
+            status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            return code in ('SlowDown', '503') or status == 503
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _slowdown_delay(attempt: int) -> float:
+    """第 attempt 次 SlowDown 之后的退避时间（秒，指数增长并加随机抖动）"""
+    return min(2 ** attempt + random.random(), 30)
+
+
+def _file_digest(file_path: str, algorithm: str) -> str:
+    """分块读取文件并计算摘要（十六进制）"""
+    digest = hashlib.new(algorithm)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_unchanged(head: Dict[str, Any], file_path: str, sha256: str, extra_args: Dict[str, str]) -> bool:
+    """
+    根据 HEAD 返回的远端对象信息判断本地文件是否未变化
+    
+    除内容外，远端的 Content-Type/Cache-Control/存储类型与本次要设置的 extra_args 不同时也视为变化，
+    这样修改 _CONTENT_TYPES 等规则后，已存在的对象也会重新上传。
+    """
+    # 未设置 ContentType 时 S3 默认为 binary/octet-stream；STANDARD 存储类型的对象 HEAD 不返回 StorageClass
+    if (head.get('ContentType') != extra_args.get('ContentType', 'binary/octet-stream')
+            or head.get('CacheControl') != extra_args.get('CacheControl')
+            or head.get('StorageClass', 'STANDARD') != extra_args.get('StorageClass', 'STANDARD')):
+        return False
+    
+    if head.get('ContentLength') != os.path.getsize(file_path):
+        return False
+    
+    remote_sha256 = head.get('Metadata', {}).get('sha256')
+    if remote_sha256:
+        return remote_sha256 == sha256
+    
+    # 没有 sha256 元数据的旧对象：非分片上传的 ETag 就是文件的 MD5
+    etag = head.get('ETag', '').strip('"')
+    if not etag or '-' in etag:
+        return False
+    return etag == _file_digest(file_path, 'md5')
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_client(max_pool_connections: int) -> Any:
+    """
+    获取共享的 S3 client（相同连接池大小只创建一次）
+    
+    创建 Session/client 需要解析凭证、加载服务模型，开销很大，不能按文件或按线程创建。
+    Session 不是线程安全的，只在这里使用；返回的 client 是线程安全的，可在线程间共享。
+    """
+    import boto3
+    import botocore.config
+    
+    _tune_http_connections()
+    session = boto3.Session(
+        aws_access_key_id=os.getenv(env_access_key_id),
+        aws_secret_access_key=os.getenv(env_access_key_secret),
+        region_name=region
+    )
+    client_config = botocore.config.Config(
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=True,
+        retries={'max_attempts': 10, 'mode': 'adaptive'}
+    )
+    return session.client('s3', config=client_config)
+
+
+def _put_until_stopped(task_q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """向有界队列放入 item，队列满时定期检查 stop；stop 被设置则放弃并返回 False"""
+    while not stop.is_set():
+        try:
+            task_q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _iter_files(root: Path) -> Iterator[os.DirEntry]:
+    """
+    用 os.scandir 惰性遍历目录，逐个返回文件（指向文件的符号链接照常返回，不进入符号链接目录）
+    
+    无法读取的目录（如没有权限）输出警告后跳过，与 Path.rglob 一样不中断遍历。
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry
+        except OSError as e:
+            print(f"   ⚠️  无法读取目录，已跳过: {current} ({e})")
+
 
 class AsyncS3Uploader:
-    def __init__(self, workers: int = 10):
+    def __init__(self, workers: int = 10,
+                 multipart_chunksize: int = 8 * 1024 * 1024,
+                 max_concurrency: int = 10,
+                 skip_unchanged: bool = True,
+                 large_file_workers: int = 4):
         """
         初始化异步S3上传器
         
         Args:
-            workers: 最大并发工作线程数
+            workers: 最大并发工作线程数（文件级并发）
+            multipart_chunksize: 分片上传的分片大小（字节），同时作为分片上传阈值
+            max_concurrency: 单个大文件分片上传的并发数（分片级并发），upload 和 upload_async 含义相同
+            skip_unchanged: 上传前 HEAD 远端对象，内容未变化的文件跳过上传
+            large_file_workers: 大文件（达到分片阈值）单独使用的线程数，
+                大文件主要依靠分片并发，避免占满小文件的线程
         """
-        session = boto3.Session(
-            aws_access_key_id=os.getenv(env_access_key_id),
-            aws_secret_access_key=os.getenv(env_access_key_secret),
-            region_name=region
-        )
-        self.s3 = session.client('s3')
         self.workers = workers
-        self.lock = Lock()
+        self.multipart_chunksize = multipart_chunksize
+        self.max_concurrency = max_concurrency
+        self.skip_unchanged = skip_unchanged
+        self.large_file_workers = large_file_workers
+        # 同时进行的慢请求重传数上限
+        self._max_hedges = max(1, self.workers // STRAGGLER_HEDGE_RATIO)
+        # 连接池需覆盖所有可能同时发出的请求，避免 "Connection pool is full" 导致请求串行化：
+        # 小文件的 workers 个上传和慢请求重传、大文件的 large_file_workers × max_concurrency 个分片，
+        # 以及两个线程池中 HEAD 请求的 workers + large_file_workers 个
+        pool_connections = (self.workers + self._max_hedges
+                            + self.large_file_workers * max_concurrency
+                            + self.workers + self.large_file_workers)
+        # self.s3 是本上传器唯一的 client，所有工作线程共享，不要在任务中重新创建
+        self.s3 = _shared_client(max(pool_connections, 50))
+        from boto3.s3.transfer import TransferConfig
+        # 直接使用 s3transfer 的 TransferManager：boto3 的 create_transfer_manager 在安装了 awscrt 时
+        # 可能返回 CRTTransferManager，它不使用上面配置的 client（连接池、自适应重试），也不支持订阅者
+        from s3transfer.manager import TransferManager
+        # 小文件和大文件分别使用 TransferManager（避免 upload_file 每次调用都重新创建传输线程池）：
+        # 同一个 TransferManager 的请求在一个 FIFO 队列中排队，分开后小文件不会排在大文件的分片后面
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunksize,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=self.workers + self._max_hedges,
+            use_threads=True,
+            max_io_queue=100
+        )
+        self.transfer_manager = TransferManager(self.s3, self.transfer_config)
+        # 每个大文件线程独占一个 TransferManager，单个大文件的分片并发不超过 max_concurrency
+        self.large_transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunksize,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+            use_threads=True,
+            max_io_queue=100
+        )
+        self._large_transfer_managers = queue.Queue()
+        for _ in range(self.large_file_workers):
+            self._large_transfer_managers.put(TransferManager(self.s3, self.large_transfer_config))
+        self._reset_counts()
+        # 进度输出由单独的线程完成，避免 print 阻塞工作线程
+        self._report_q = queue.Queue()
+        threading.Thread(target=self._report_loop, daemon=True).start()
+        # 最近小文件的上传耗时，由监控线程定期计算慢请求阈值（样本不足时为 None）
+        self._durations = collections.deque(maxlen=STRAGGLER_SAMPLES)
+        self._durations_lock = threading.Lock()
+        self._straggler_timeout = None
+        self._hedges = threading.BoundedSemaphore(self._max_hedges)
+        self._slowdown_until = 0.0
+        self._closed = threading.Event()
+        threading.Thread(target=self._straggler_loop, daemon=True).start()
+    
+    def _reset_counts(self) -> None:
+        """重置计数（每次上传开始时调用，此时上一次上传的进度已全部输出）"""
+        # 计数器的 next() 在 CPython 下是原子的，工作线程无需加锁
+        self._ok = itertools.count(1)
+        self._fail = itertools.count(1)
+        self._skip = itertools.count(1)
         self.uploaded_count = 0
         self.failed_count = 0
+        self.skipped_count = 0
+    
+    def _begin_upload(self) -> None:
+        """开始一次上传：检查上传器未关闭，并重置计数，使结果和统计只反映本次上传"""
+        if self._closed.is_set():
+            raise RuntimeError("上传器已关闭，不能再上传")
+        self._reset_counts()
     
-    def get_file_headers(self, file_path: str) -> Dict[str, str]:
-        """根据文件类型获取合适的HTTP头"""
-        headers = {
+    @staticmethod
+    def get_file_headers(file_path: Union[str, LocalFile]) -> Dict[str, str]:
+        """根据文件类型获取合适的HTTP头（直接返回 S3 ExtraArgs 格式）"""
+        name = os.path.basename(os.fspath(file_path))
+        extra_args = {
             'StorageClass': 'STANDARD'
         }
         
         # 根据文件扩展名设置Content-Type
-        ext = Path(file_path).suffix.lower()
-        content_types = {
-            '.html': 'text/html',
-            '.css': 'text/css',
-            '.js': 'application/javascript',
-            '.json': 'application/json',
-            '.png': 'image/png',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.gif': 'image/gif',
-            '.svg': 'image/svg+xml',
-            '.ico': 'image/x-icon',
-            '.webp': 'image/webp',
-            '.txt': 'text/plain',
-            '.md': 'text/markdown',
-            '.xml': 'application/xml',
-            '.pdf': 'application/pdf',
-            '.zip': 'application/zip',
-            '.woff': 'font/woff',
-            '.woff2': 'font/woff2',
-            '.ttf': 'font/ttf',
-            '.eot': 'application/vnd.ms-fontobject'
-        }
-        
-        if ext in content_types:
-            headers['ContentType'] = content_types[ext]
+        content_type = _CONTENT_TYPES.get(os.path.splitext(name)[1].lower())
+        if content_type:
+            extra_args['ContentType'] = content_type
         
-        if Path(file_path).name == 'index.html':
-            headers['CacheControl'] = 'no-cache'
+        if name == 'index.html':
+            extra_args['CacheControl'] = 'no-cache'
         
-        return headers
+        return extra_args
     
-    def _upload_single_file(self, file_path: Path, s3_key: str) -> bool:
+    def _upload_single_file(self, file_path: LocalFile, s3_key: str) -> bool:
         """上传单个文件（线程安全）"""
         try:
-            headers = self.get_file_headers(str(file_path))
+            local_path = os.fspath(file_path)
+            extra_args = self.get_file_headers(file_path)
             
-            # 将 headers 转换为 S3 ExtraArgs 格式
-            extra_args = {}
-            if 'ContentType' in headers:
-                extra_args['ContentType'] = headers['ContentType']
-            if 'CacheControl' in headers:
-                extra_args['CacheControl'] = headers['CacheControl']
-            if 'StorageClass' in headers:
-                extra_args['StorageClass'] = headers['StorageClass']
+            if self.skip_unchanged:
+                sha256 = _file_digest(local_path, 'sha256')
+                if not self._needs_upload(local_path, s3_key, sha256, extra_args):
+                    self._report_q.put(('skip', next(self._skip), file_path.name, s3_key))
+                    return True
+                # 记录内容摘要，下次比较时无需再计算 MD5
+                extra_args['Metadata'] = {'sha256': sha256}
             
-            self.s3.upload_file(
-                str(file_path), 
-                bucket_name, 
-                s3_key,
-                ExtraArgs=extra_args
-            )
+            self._upload_with_backoff(local_path, s3_key, extra_args, file_path.stat().st_size)
             
-            with self.lock:
-                self.uploaded_count += 1
-                print(f"✅ 上传成功 ({self.uploaded_count}): {file_path.name} -> {s3_key}")
+            self._report_q.put(('ok', next(self._ok), file_path.name, s3_key))
             
             return True
             
         except Exception as e:
-            with self.lock:
-                self.failed_count += 1
-                print(f"❌ 上传失败 ({self.failed_count}): {file_path.name} -> {e}")
+            self._report_q.put(('fail', next(self._fail), file_path.name, e))
             return False
     
+    def _needs_upload(self, file_path: str, s3_key: str, sha256: str, extra_args: Dict[str, str]) -> bool:
+        """HEAD 远端对象，不存在或内容、HTTP 头不同时才需要上传"""
+        from botocore.exceptions import ClientError
+        try:
+            head = self.s3.head_object(Bucket=bucket_name, Key=s3_key)
+        except ClientError:
+            return True
+        return not _is_unchanged(head, file_path, sha256, extra_args)
+    
+    def _report_loop(self) -> None:
+        """输出上传进度（仅在输出线程中运行，各计数只在这里写入）"""
+        last_print = 0.0
+        while True:
+            item = self._report_q.get()
+            try:
+                if item is None:
+                    return
+                status, n, name, detail = item
+                # 成功/跳过的进度限流输出，文件很多时不让 stdout 成为瓶颈
+                now = time.monotonic()
+                verbose = n % PROGRESS_EVERY == 0 or now - last_print > PROGRESS_INTERVAL
+                if verbose:
+                    last_print = now
+                # 多个线程入队的先后不一定与编号一致，取最大值作为计数
+                if status == 'ok':
+                    self.uploaded_count = max(self.uploaded_count, n)
+                    if verbose:
+                        print(f"✅ 上传成功 ({n}): {name} -> {detail}")
+                elif status == 'skip':
+                    self.skipped_count = max(self.skipped_count, n)
+                    if verbose:
+                        print(f"⏭️  未变化，跳过 ({n}): {name} -> {detail}")
+                else:
+                    self.failed_count = max(self.failed_count, n)
+                    print(f"❌ 上传失败 ({n}): {name} -> {detail}")
+            except Exception:
+                # 输出失败（如 stdout 管道已关闭）不能让线程退出，否则 join() 会一直等待
+                pass
+            finally:
+                self._report_q.task_done()
+    
+    def _upload_with_backoff(self, file_path: str, s3_key: str, extra_args: Dict[str, str],
+                             size: int) -> None:
+        """上传文件，遇到 503 SlowDown 时指数退避后重试"""
+        for attempt in range(SLOWDOWN_MAX_ATTEMPTS):
+            try:
+                if size >= self.multipart_chunksize:
+                    # 分片上传的大文件耗时主要取决于大小，不做慢请求重传
+                    self._transfer_large(file_path, s3_key, extra_args)
+                else:
+                    self._transfer(file_path, s3_key, extra_args)
+                return
+            except Exception as e:
+                if not _is_slowdown(e) or attempt == SLOWDOWN_MAX_ATTEMPTS - 1:
+                    raise
+                delay = _slowdown_delay(attempt)
+                # 服务端在限流，退避期间及之后一段时间内不做慢请求重传
+                self._slowdown_until = max(self._slowdown_until,
+                                           time.monotonic() + delay + SLOWDOWN_HEDGE_COOLDOWN)
+                time.sleep(delay)
+    
+    def _transfer_large(self, file_path: str, s3_key: str, extra_args: Dict[str, str]) -> None:
+        """取一个空闲的大文件 TransferManager 分片上传文件，上传期间由当前线程独占"""
+        transfer_manager = self._large_transfer_managers.get()
+        try:
+            transfer_manager.upload(file_path, bucket_name, s3_key, extra_args=extra_args).result()
+        finally:
+            self._large_transfer_managers.put(transfer_manager)
+    
+    def _transfer(self, file_path: str, s3_key: str, extra_args: Dict[str, str]) -> None:
+        """
+        通过小文件的 TransferManager 上传文件
+        
+        请求开始发送后耗时超过慢请求阈值（在 TransferManager 中排队的时间不计入），
+        则用连接池中的另一个连接再上传一次；两次上传内容相同，先成功的为准，都失败时抛出异常。
+        """
+        changed = threading.Event()
+        first = _TransferWatcher(changed)
+        futures = [self._submit(file_path, s3_key, extra_args, first)]
+        hedged = False
+        
+        error = None
+        while True:
+            wait_timeout = None
+            if not hedged and first.started_at is not None:
+                timeout = self._straggler_timeout
+                if timeout is None:
+                    # 阈值还没有算出来，稍后再检查
+                    wait_timeout = STRAGGLER_CHECK_INTERVAL
+                else:
+                    wait_timeout = first.started_at + timeout - time.monotonic()
+                    if wait_timeout <= 0:
+                        if self._start_hedge(file_path, s3_key, extra_args, changed, futures):
+                            hedged = True
+                            continue
+                        # 暂时不能重传（限流退避中或名额已满），稍后再试
+                        wait_timeout = STRAGGLER_CHECK_INTERVAL
+            
+            changed.wait(wait_timeout)
+            changed.clear()
+            finished = [future for future in futures if future.done()]
+            for future in finished:
+                try:
+                    future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                # 已成功，另一次上传（如果还没开始）不再需要
+                for other in futures:
+                    if other is not future:
+                        other.cancel()
+                if first.started_at is not None:
+                    with self._durations_lock:
+                        self._durations.append(time.monotonic() - first.started_at)
+                return
+            if len(finished) == len(futures):
+                raise error
+    
+    def _start_hedge(self, file_path: str, s3_key: str, extra_args: Dict[str, str],
+                     changed: threading.Event, futures: List[Any]) -> bool:
+        """发起一次重传并返回 True；SlowDown 退避期间或同时进行的重传已达上限时不发起，返回 False"""
+        if time.monotonic() < self._slowdown_until:
+            return False
+        if not self._hedges.acquire(blocking=False):
+            return False
+        # 重传结束（无论成功、失败还是被取消）时释放名额
+        watcher = _TransferWatcher(changed, on_finish=self._hedges.release)
+        try:
+            futures.append(self._submit(file_path, s3_key, extra_args, watcher))
+        except Exception:
+            self._hedges.release()
+            raise
+        return True
+    
+    def _submit(self, file_path: str, s3_key: str, extra_args: Dict[str, str],
+                watcher: _TransferWatcher) -> Any:
+        """向小文件的 TransferManager 提交一次上传"""
+        return self.transfer_manager.upload(
+            file_path,
+            bucket_name,
+            s3_key,
+            extra_args=extra_args,
+            subscribers=[watcher]
+        )
+    
+    def _straggler_loop(self) -> None:
+        """监控线程：定期根据最近的上传耗时更新慢请求阈值"""
+        while not self._closed.wait(STRAGGLER_CHECK_INTERVAL):
+            with self._durations_lock:
+                samples = sorted(self._durations)
+            if len(samples) >= STRAGGLER_MIN_SAMPLES:
+                p99 = samples[int(len(samples) * 0.99) - 1]
+                self._straggler_timeout = max(p99 * 2, STRAGGLER_MIN_TIMEOUT)
+    
     def upload(self, src_path: str, dst_path: str, include_root: bool = False) -> bool:
         """
         上传文件或目录到S3
@@ -119,6 +542,7 @@ class AsyncS3Uploader:
         Returns:
             bool: 上传是否成功
         """
+        self._begin_upload()
         src_path = Path(src_path)
         dst_path = dst_path.rstrip('/')
         
@@ -143,9 +567,24 @@ class AsyncS3Uploader:
             print(f"❌ 上传过程中发生错误: {e}")
             return False
         finally:
+            self._report_q.join()
             elapsed_time = time.time() - start_time
             print(f"⏱️  总耗时: {elapsed_time:.2f}秒")
     
+    def close(self) -> None:
+        """关闭 TransferManager、进度输出线程和慢请求监控线程"""
+        self.transfer_manager.shutdown()
+        for _ in range(self.large_file_workers):
+            self._large_transfer_managers.get().shutdown()
+        self._report_q.put(None)
+        self._closed.set()
+    
+    def __enter__(self) -> 'AsyncS3Uploader':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+    
     def _upload_single_file_sync(self, file_path: Path, dst_path: str) -> bool:
         """同步上传单个文件"""
         try:
@@ -183,103 +622,336 @@ class AsyncS3Uploader:
         """上传目录"""
         print(f"📁 开始上传目录: {dir_path} -> {dst_path}")
         print(f"📋 模式: {'包含根目录' if include_root else '仅内容'}")
-        print(f"🚀 并发上传 (最大 {self.workers} 线程)")
-        
-        # 收集所有需要上传的文件
-        upload_tasks = []
-        excluded_files = []
-        warning_files = []
-        
-        for file_path in dir_path.rglob('*'):
-            if file_path.is_file():
-                # 排除 .DS_Store 文件
-                if file_path.name == '.DS_Store':
-                    excluded_files.append(file_path)
-                    continue
-                
-                # 检查是否是以 . 开头的文件
-                if file_path.name.startswith('.'):
-                    warning_files.append(file_path)
-                
-                if include_root:
-                    relative_path = str(file_path)
-                else:
-                    relative_path = file_path.relative_to(dir_path)
-                
-                relative_path = str(relative_path)
-                s3_key = f"{dst_path}/{relative_path}".replace("\\", "/")
-                s3_key = s3_key.lstrip('/')
-                
-                upload_tasks.append((file_path, s3_key))
+        print(f"🚀 并发上传 (最大 {self.workers} 线程，大文件另用 {self.large_file_workers} 线程)")
         
+        # 边遍历边上传，不预先收集全部文件
+        stats = {'total': 0, 'excluded': 0, 'warning': 0}
+        upload_tasks = self._iter_upload_tasks(dir_path, dst_path, include_root, stats)
+        success = self._upload_concurrent(upload_tasks)
+        self._print_walk_summary(stats)
+        return success
+    
+    def _print_walk_summary(self, stats: Dict[str, int]) -> None:
+        """显示目录遍历的统计信息"""
         # 显示排除的文件
-        if excluded_files:
-            print(f"🚫 已排除 {len(excluded_files)} 个 .DS_Store 文件")
+        if stats['excluded']:
+            print(f"🚫 已排除 {stats['excluded']} 个 .DS_Store 文件")
         
         # 显示警告信息
-        if warning_files:
-            print(f"⚠️  发现 {len(warning_files)} 个以 . 开头的文件:")
-            for file_path in warning_files:
-                print(f"   ⚠️  {file_path}")
+        if stats['warning']:
+            print(f"⚠️  上传了 {stats['warning']} 个以 . 开头的文件")
             print("   这些文件通常是隐藏文件，请确认是否需要上传")
         
-        total_files = len(upload_tasks)
-        print(f"📊 发现 {total_files} 个文件需要上传")
-        
-        if total_files == 0:
+        print(f"📊 共处理 {stats['total']} 个文件")
+        if stats['total'] == 0:
             print("ℹ️  没有文件需要上传")
-            return True
-        
-        if total_files == 1:
-            # 单个文件直接上传
-            file_path, s3_key = upload_tasks[0]
-            return self._upload_single_file(file_path, s3_key)
+    
+    def _iter_upload_tasks(self, dir_path: Path, dst_path: str, include_root: bool,
+                           stats: Dict[str, int]) -> Iterator[Tuple[os.DirEntry, str]]:
+        """遍历目录，逐个生成 (本地文件, S3 key) 上传任务，并在 stats 中记录统计"""
+        # key 前缀和要去掉的根目录长度只计算一次，每个文件只做一次切片和拼接
+        prefix = f"{dst_path}/".lstrip('/')
+        root = os.fspath(Path(dir_path))
+        if not include_root:
+            root_len = len(os.path.join(root, ''))
+        elif root == os.curdir:
+            # 与 pathlib 一致：Path('.') / 'a.txt' 为 'a.txt'，去掉 scandir 产生的 './' 前缀
+            root_len = len(os.path.join(os.curdir, ''))
         else:
-            # 多个文件使用并发上传
-            return self._upload_concurrent(upload_tasks)
+            root_len = 0
+        
+        for entry in _iter_files(root):
+            # 排除 .DS_Store 文件
+            if entry.name == '.DS_Store':
+                stats['excluded'] += 1
+                continue
+            
+            # 检查是否是以 . 开头的文件
+            if entry.name.startswith('.'):
+                stats['warning'] += 1
+                print(f"   ⚠️  发现以 . 开头的文件: {entry.path}")
+            
+            s3_key = prefix + entry.path[root_len:]
+            if os.sep != '/':
+                s3_key = s3_key.replace(os.sep, '/')
+            if include_root:
+                s3_key = s3_key.lstrip('/')
+            
+            stats['total'] += 1
+            yield entry, s3_key
     
-    def _upload_concurrent(self, upload_tasks: List[Tuple[Path, str]]) -> bool:
-        """并发上传文件"""
+    def _upload_concurrent(self, upload_tasks: Iterable[Tuple[LocalFile, str]]) -> bool:
+        """
+        并发上传文件，内存占用与文件总数无关
+        
+        小文件和大文件（达到分片阈值）分别进入两个线程池，各自有独立的队列和分发线程，
+        大文件线程池排满时不影响小文件的分发；每个线程池同时在途的任务数不超过其线程数 * 2。
+        """
         print("⚡ 使用并发上传模式")
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            # 提交所有上传任务
-            future_to_task = {
-                executor.submit(self._upload_single_file, file_path, s3_key): (file_path, s3_key)
-                for file_path, s3_key in upload_tasks
-            }
+        # 遍历目录（过滤、生成 key、读取大小）放到单独的生产者线程中，与上传重叠进行
+        small_q = queue.Queue(maxsize=self.workers * 4)
+        # 大文件队列不设上限，生产者不会因大文件线程池排满而停下；
+        # 每项至少对应一个分片大小的数据，排队的数量相对上传量很小
+        large_q = queue.Queue()
+        errors = []
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce_tasks, args=(upload_tasks, small_q, large_q, errors, stop), daemon=True
+        )
+        producer.start()
+        
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as small_pool, \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=self.large_file_workers) as large_pool:
+                large_dispatcher = threading.Thread(
+                    target=self._dispatch,
+                    args=(large_q, large_pool, self.large_file_workers * 2, errors, stop),
+                    daemon=True
+                )
+                large_dispatcher.start()
+                self._dispatch(small_q, small_pool, self.workers * 2, errors, stop)
+                large_dispatcher.join()
+        finally:
+            # 消费端异常退出时通知生产者停止，避免其阻塞在已满的队列上并一直占用目录句柄
+            stop.set()
+            producer.join()
+        
+        if errors:
+            raise errors[0]
+        
+        # 等待输出线程处理完所有进度，计数才是最终值
+        self._report_q.join()
+        print(f"📊 并发上传完成: 成功 {self.uploaded_count} 个文件，"
+              f"跳过 {self.skipped_count} 个未变化文件，失败 {self.failed_count} 个文件")
+        return self.failed_count == 0
+    
+    def _dispatch(self, task_q: queue.Queue, executor: concurrent.futures.Executor, max_pending: int,
+                  errors: List[Exception], stop: threading.Event) -> None:
+        """
+        分发循环：从 task_q 取任务提交到 executor，在途任务不超过 max_pending，取到 None 时结束
+        
+        出错时记录到 errors 并设置 stop；stop 被设置后不再提交新任务，只等待在途任务完成。
+        """
+        pending = set()
+        try:
+            for file_path, s3_key in iter(task_q.get, None):
+                if stop.is_set():
+                    break
+                if len(pending) >= max_pending:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    self._collect_results(done)
+                pending.add(executor.submit(self._upload_single_file, file_path, s3_key))
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            # 等待剩余任务完成
+            self._collect_results(concurrent.futures.as_completed(pending))
+    
+    async def upload_async(self, src_path: str, dst_path: str, include_root: bool = False) -> bool:
+        """
+        使用 aioboto3 + asyncio 上传目录（需要安装 aioboto3），单个文件仍使用线程上传
+        
+        所有上传在同一个事件循环中进行，不受线程数和 GIL 切换的限制，
+        同时在途的上传数不超过 workers。参数和返回值与 upload 相同。
+        单个文件的上传和目录遍历都放到线程中进行，不会阻塞调用方的事件循环。
+        """
+        src_path = Path(src_path)
+        if not src_path.is_dir():
+            return await asyncio.to_thread(self.upload, str(src_path), dst_path, include_root)
+        self._begin_upload()
+        
+        from boto3.s3.transfer import TransferConfig
+        try:
+            import aioboto3
+            from aiobotocore.config import AioConfig
+        except ImportError:
+            print("❌ asyncio 上传模式需要安装 aioboto3: pip install aioboto3")
+            return False
+        
+        dst_path = dst_path.rstrip('/')
+        print(f"📁 开始上传目录: {src_path} -> {dst_path}")
+        print(f"📋 模式: {'包含根目录' if include_root else '仅内容'}")
+        print(f"🚀 asyncio 并发上传 (最多同时 {self.workers} 个文件)")
+        
+        start_time = time.time()
+        session = aioboto3.Session(
+            aws_access_key_id=os.getenv(env_access_key_id),
+            aws_secret_access_key=os.getenv(env_access_key_secret),
+            region_name=region
+        )
+        client_config = AioConfig(
+            max_pool_connections=max(self.workers * self.max_concurrency, 50),
+            retries={'max_attempts': 10, 'mode': 'adaptive'}
+        )
+        # 事件循环中的分片并发按单个文件计算
+        transfer_config = TransferConfig(
+            multipart_threshold=self.multipart_chunksize,
+            multipart_chunksize=self.multipart_chunksize,
+            max_concurrency=self.max_concurrency
+        )
+        stats = {'total': 0, 'excluded': 0, 'warning': 0}
+        
+        try:
+            async with session.client('s3', config=client_config) as client:
+                semaphore = asyncio.Semaphore(self.workers)
+                pending = set()
+                upload_tasks = self._iter_upload_tasks(src_path, dst_path, include_root, stats)
+                try:
+                    # os.scandir 是阻塞调用，在线程中每次取出一批任务
+                    while True:
+                        batch = await asyncio.to_thread(list, itertools.islice(upload_tasks, ASYNC_WALK_BATCH))
+                        if not batch:
+                            break
+                        for file_path, s3_key in batch:
+                            # 先拿到信号量再创建任务，在途任务数（以及内存）不随文件总数增长
+                            await semaphore.acquire()
+                            task = asyncio.ensure_future(
+                                self._upload_single_file_async(client, file_path, s3_key, transfer_config)
+                            )
+                            task.add_done_callback(lambda _: semaphore.release())
+                            task.add_done_callback(pending.discard)
+                            pending.add(task)
+                finally:
+                    upload_tasks.close()
+                    # 遍历出错时也要等已开始的上传结束，再关闭 client
+                    await asyncio.gather(*pending, return_exceptions=True)
+            
+            await asyncio.to_thread(self._report_q.join)
+            print(f"📊 并发上传完成: 成功 {self.uploaded_count} 个文件，"
+                  f"跳过 {self.skipped_count} 个未变化文件，失败 {self.failed_count} 个文件")
+            self._print_walk_summary(stats)
+            return self.failed_count == 0
+            
+        except Exception as e:
+            print(f"❌ 上传过程中发生错误: {e}")
+            return False
+        finally:
+            await asyncio.to_thread(self._report_q.join)
+            elapsed_time = time.time() - start_time
+            print(f"⏱️  总耗时: {elapsed_time:.2f}秒")
+    
+    async def _upload_single_file_async(self, client: Any, file_path: LocalFile, s3_key: str,
+                                        transfer_config: 'TransferConfig') -> bool:
+        """在事件循环中上传单个文件"""
+        from botocore.exceptions import ClientError
+        try:
+            local_path = os.fspath(file_path)
+            extra_args = self.get_file_headers(file_path)
             
-            # 等待所有任务完成
-            for future in concurrent.futures.as_completed(future_to_task):
-                file_path, s3_key = future_to_task[future]
+            if self.skip_unchanged:
+                # 读文件计算摘要放到线程中，避免阻塞事件循环
+                sha256 = await asyncio.to_thread(_file_digest, local_path, 'sha256')
                 try:
-                    future.result()  # 获取结果，如果有异常会在这里抛出
-                except Exception as e:
-                    print(f"❌ 任务异常 {file_path}: {e}")
+                    head = await client.head_object(Bucket=bucket_name, Key=s3_key)
+                except ClientError:
+                    head = None
+                if head and await asyncio.to_thread(_is_unchanged, head, local_path, sha256, extra_args):
+                    self._report_q.put(('skip', next(self._skip), file_path.name, s3_key))
+                    return True
+                extra_args['Metadata'] = {'sha256': sha256}
+            
+            await self._upload_with_backoff_async(client, local_path, s3_key, extra_args, transfer_config)
+            self._report_q.put(('ok', next(self._ok), file_path.name, s3_key))
+            return True
+            
+        except Exception as e:
+            self._report_q.put(('fail', next(self._fail), file_path.name, e))
+            return False
+    
+    async def _upload_with_backoff_async(self, client: Any, file_path: str, s3_key: str,
+                                         extra_args: Dict[str, str], transfer_config: 'TransferConfig') -> None:
+        """在事件循环中上传文件，遇到 503 SlowDown 时指数退避后重试"""
+        for attempt in range(SLOWDOWN_MAX_ATTEMPTS):
+            try:
+                await client.upload_file(
+                    file_path,
+                    bucket_name,
+                    s3_key,
+                    ExtraArgs=extra_args,
+                    Config=transfer_config
+                )
+                return
+            except Exception as e:
+                if not _is_slowdown(e) or attempt == SLOWDOWN_MAX_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(_slowdown_delay(attempt))
+    
+    def _produce_tasks(self, upload_tasks: Iterable[Tuple[LocalFile, str]], small_q: queue.Queue,
+                       large_q: queue.Queue, errors: List[Exception], stop: threading.Event) -> None:
+        """
+        生产者线程：按文件大小把上传任务放入小文件/大文件队列，结束时各放入 None；
+        遍历出错时记录到 errors
         
-        print(f"📊 并发上传完成: 成功 {self.uploaded_count} 个文件，失败 {self.failed_count} 个文件")
-        return self.failed_count == 0
+        stop 被设置后（消费端已退出）不再入队，并关闭遍历生成器以释放目录句柄。
+        """
+        try:
+            for file_path, s3_key in upload_tasks:
+                if stop.is_set():
+                    return
+                try:
+                    # DirEntry 会缓存 stat 结果，工作线程中再次读取大小时无需系统调用
+                    size = file_path.stat().st_size
+                except OSError as e:
+                    # 遍历之后文件被删除等情况，按单个文件上传失败计数
+                    self._report_q.put(('fail', next(self._fail), file_path.name, e))
+                    continue
+                
+                if size >= self.multipart_chunksize:
+                    large_q.put((file_path, s3_key))
+                elif not _put_until_stopped(small_q, (file_path, s3_key), stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            close = getattr(upload_tasks, 'close', None)
+            if close:
+                close()
+            large_q.put(None)
+            _put_until_stopped(small_q, None, stop)
+    
+    def _collect_results(self, futures: Iterable[concurrent.futures.Future]) -> None:
+        """获取已完成任务的结果，如果有异常会在这里打印"""
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ 任务异常: {e}")
 
 
-def upload(src_path: str, dst_path: str, include_root: bool = False, workers: int = 10) -> bool:
+def upload(src_path: str, dst_path: str, include_root: bool = False, workers: int = 10,
+           use_asyncio: bool = False, skip_unchanged: bool = True) -> bool:
     """
     便捷的上传函数
     
+    每次调用都会创建并关闭一个上传器（S3 client 是共享的）；需要多次上传时，
+    可以直接使用 with AsyncS3Uploader(...) as uploader 复用同一个上传器，
+    每次 upload 的返回值和统计只反映本次上传；上传器关闭后不能再上传。
+    
     Args:
         src_path: 本地源路径
         dst_path: S3目标路径
         include_root: 是否包含根目录
-        workers: 最大并发工作线程数
+        workers: 最大并发工作线程数（asyncio 模式下为最大同时上传文件数）
+        use_asyncio: 是否使用 aioboto3 + asyncio 上传目录（需要安装 aioboto3）
+        skip_unchanged: 是否跳过远端已存在且内容相同的文件
     
     Returns:
         bool: 上传是否成功
     """
-    uploader = AsyncS3Uploader(workers=workers)
-    return uploader.upload(src_path, dst_path, include_root)
+    with AsyncS3Uploader(workers=workers, skip_unchanged=skip_unchanged) as uploader:
+        if use_asyncio:
+            return asyncio.run(uploader.upload_async(src_path, dst_path, include_root))
+        return uploader.upload(src_path, dst_path, include_root)
 
 
 def parse_arguments():
     """解析命令行参数"""
+    import argparse
+    
     parser = argparse.ArgumentParser(
         description='上传文件或目录到AWS S3',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -318,6 +990,18 @@ def parse_arguments():
         help='并发工作线程数（默认10）'
     )
     
+    parser.add_argument(
+        '--asyncio',
+        action='store_true',
+        help='使用 aioboto3 + asyncio 上传目录（需要安装 aioboto3）'
+    )
+    
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='强制上传所有文件（默认跳过远端已存在且内容相同的文件）'
+    )
+    
     return parser.parse_args()
 
 
@@ -329,9 +1013,11 @@ if __name__ == "__main__":
     print(f"🎯 目标路径: {args.dst_path}")
     print(f"📋 模式: {'包含根目录' if args.include_root else '仅内容'}")
     print(f"⚡ 并发线程: {args.workers}")
+    print(f"🔀 asyncio 模式: {'是' if args.asyncio else '否'}")
     print("-" * 50)
     
-    success = upload(args.src_path, args.dst_path, args.include_root, args.workers)
+    success = upload(args.src_path, args.dst_path, args.include_root, args.workers, args.asyncio,
+                     not args.force)
     
     if success:
         print("✅ 上传完成！")